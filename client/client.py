@@ -1,4 +1,4 @@
-import socket, json, struct
+import socket, json, struct, uuid
 
 EDGE_BASE_PORT = 8001
 NUM_EDGES = 5
@@ -13,14 +13,19 @@ def recv_exact(sock, n: int) -> bytes:
         data += packet
     return data
 
-def rpc_call(s: socket.socket, function: str, args: list, clock: int):
+def rpc_call(s: socket.socket, function: str, args: list, clock: int, trace_id: str = None):
     """
     Send framed RPC to an already-connected socket `s` and return the response.
     The framing matches your project's format:
       - Request: 8-byte length (unsigned long long) + JSON bytes
       - Response: 8-byte clock (unsigned long long) + function-specific payload
+    If `trace_id` is given it is sent along so the LB/edges log their spans under it
+    (whether the request is sampled is still decided by the LB).
     """
-    request = json.dumps({"function": function, "args": args, "clock": clock}).encode()
+    request = {"function": function, "args": args, "clock": clock}
+    if trace_id is not None:
+        request["trace_id"] = trace_id
+    request = json.dumps(request).encode()
     # Send request length first
     s.sendall(struct.pack("Q", len(request)))
     s.sendall(request)
@@ -43,6 +48,18 @@ def rpc_call(s: socket.socket, function: str, args: list, clock: int):
     elif function == "get_image_size":
         size_data = recv_exact(s, 8)
         (size,) = struct.unpack("Q", size_data)
+        # A real size ends the reply; on failure `size` is the length of a JSON error body
+        body = b""
+        while len(body) < size:
+            packet = s.recv(size - len(body))
+            if not packet:
+                break
+            body += packet
+        if body:
+            try:
+                return resp_clock, json.loads(body.decode())
+            except Exception:
+                return resp_clock, body
         return resp_clock, {"size": size}
     else:
         # Generic: read a following 8-byte length and payload
@@ -79,6 +96,7 @@ def main():
             continue
 
         host, port = pick_edge_for_image(img_id)
+        trace_id = uuid.uuid4().hex
 
         # Open connection to selected edge and perform RPC
         try:
@@ -86,8 +104,8 @@ def main():
                 s.connect((host, port))
                 if op == 1:
                     logical_clock += 1
-                    print(f"Client: Sending get_image request at clock {logical_clock}")
-                    resp_clock, resp = rpc_call(s, "get_image", [img_id], logical_clock)
+                    print(f"Client: Sending get_image request at clock {logical_clock} (trace {trace_id})")
+                    resp_clock, resp = rpc_call(s, "get_image", [img_id], logical_clock, trace_id)
                     # If resp is dict => error, else bytes => image
                     if isinstance(resp, dict) and resp.get("error"):
                         print("Error from edge:", resp)
@@ -99,8 +117,8 @@ def main():
                         print(f"Saved {fname} (from edge {port})")
                 elif op == 2:
                     logical_clock += 1
-                    print(f"Client: Sending get_image_size request at clock {logical_clock}")
-                    resp_clock, resp = rpc_call(s, "get_image_size", [img_id], logical_clock)
+                    print(f"Client: Sending get_image_size request at clock {logical_clock} (trace {trace_id})")
+                    resp_clock, resp = rpc_call(s, "get_image_size", [img_id], logical_clock, trace_id)
                     if isinstance(resp, dict) and resp.get("size") is not None:
                         print(f"Size: {resp['size']} bytes (from edge {port})")
                     else:
@@ -0,0 +1,110 @@
+"""
+Helpers shared by the canonical server, edge servers and load balancer.
+The components are run as scripts from their own folders, so each one puts the
+repo root on sys.path before importing this module.
+Admission control:
+- WorkerPool: fixed worker threads fed by a bounded queue
+- send_overloaded: fast-path {"error": "overloaded"} reply when a queue is full; from
+  an accept loop the reply and drain are handed to a small reject pool
+- recv_ack / OverloadedError: let callers of clock-only RPCs notice they were shed
+"""
+import socket, json, struct, threading, queue, time
+
+REJECT_DRAIN_TIMEOUT = 0.2  # total time a rejected connection may spend draining its request
+REJECT_DRAIN_BYTES = 64 * 1024
+REJECT_WORKER_THREADS = 2
+REJECT_QUEUE_LIMIT = 256
+OVERLOADED = json.dumps({"error": "overloaded"}).encode()
+
+class OverloadedError(Exception):
+    """The peer shed the RPC with {"error": "overloaded"} instead of handling it."""
+
+def recv_upto(sock, n: int) -> bytes:
+    """Like recv_exact, but returns early (possibly short) if the peer closes."""
+    data = b""
+    while len(data) < n:
+        packet = sock.recv(n - len(data))
+        if not packet:
+            break
+        data += packet
+    return data
+
+def recv_ack(sock):
+    """Read the reply to a clock-only RPC (heartbeat, coordinator, notify_cached).
+    A handled RPC ends right after the 8-byte clock; a shed one carries the overload body."""
+    reply = recv_upto(sock, 16 + len(OVERLOADED))
+    if len(reply) < 8:
+        raise ConnectionError("Connection closed")
+    if reply[16:] == OVERLOADED:
+        raise OverloadedError("overloaded")
+
+class WorkerPool:
+    """Fixed set of worker threads fed by a bounded queue. submit() never blocks."""
+    def __init__(self, name: str, num_workers: int, queue_limit: int):
+        self.name = name
+        self.tasks = queue.Queue(maxsize=queue_limit)
+        for _ in range(num_workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, fn, *args) -> bool:
+        try:
+            self.tasks.put_nowait((fn, args))
+            return True
+        except queue.Full:
+            return False
+
+    def _worker(self):
+        while True:
+            fn, args = self.tasks.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"{self.name}: task failed -> {e}")
+
+_reject_pool = None
+_reject_pool_lock = threading.Lock()
+
+def send_overloaded(conn: socket.socket, drain: bool):
+    """Reply <clock><size>{"error": "overloaded"} and close.
+    drain=True is for accept loops, where the request is still unread: the reply goes out
+    with one non-blocking send (it always fits an empty socket buffer), and the bounded
+    drain that keeps close() from resetting it runs on a background reject pool, never on
+    the accept thread. If that pool is backed up too, the connection is just closed."""
+    global _reject_pool
+    reply = struct.pack("Q", 0) + struct.pack("Q", len(OVERLOADED)) + OVERLOADED
+    if not drain:
+        try:
+            conn.sendall(reply)
+        except Exception:
+            pass
+        finally:
+            conn.close()
+        return
+    try:
+        conn.setblocking(False)
+        conn.send(reply)
+        conn.shutdown(socket.SHUT_WR)
+    except Exception:
+        conn.close()
+        return
+    with _reject_pool_lock:
+        if _reject_pool is None:
+            _reject_pool = WorkerPool("Reject pool", REJECT_WORKER_THREADS, REJECT_QUEUE_LIMIT)
+    if not _reject_pool.submit(_drain_and_close, conn):
+        conn.close()
+
+def _drain_and_close(conn: socket.socket):
+    # bounded in total, so a peer that never closes or keeps trickling bytes can't hold a reject worker
+    deadline = time.time() + REJECT_DRAIN_TIMEOUT
+    drained = 0
+    try:
+        while drained < REJECT_DRAIN_BYTES and time.time() < deadline:
+            conn.settimeout(max(0.001, deadline - time.time()))
+            data = conn.recv(4096)
+            if not data:
+                break
+            drained += len(data)
+    except Exception:
+        pass
+    finally:
+        conn.close()
@@ -0,0 +1,68 @@
+"""
+Request tracing shared by the canonical server, edge servers and load balancer.
+Requests carry "trace_id" and "sampled" fields; each hop records a Span and sampled
+spans are appended to a per-component JSON-lines SpanLog.
+See trace_analyzer/trace_analyzer.py for turning the logs into latency reports.
+All components write under the same TRACE_DIR (<repo>/traces, or $CDN_TRACE_DIR)
+wherever they are started from, so the analyzer can join the hops of a trace.
+"""
+import json, os, threading, time, queue
+
+TRACE_DIR = os.environ.get("CDN_TRACE_DIR") or os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "traces"))
+
+class SpanLog:
+    """Append-only JSON-lines span log. Records are written by a background thread
+    so request handlers only pay for a queue put."""
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = queue.SimpleQueue()
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def write(self, record: dict):
+        self.pending.put(record)
+
+    def _writer(self):
+        record = self.pending.get()  # nothing touches disk until the first sampled span
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            while True:
+                f.write(json.dumps(record) + "\n")
+                if self.pending.empty():
+                    f.flush()
+                record = self.pending.get()
+
+class Span:
+    """Timings for one request on this hop: stages are (name, ms since accept)."""
+    def __init__(self, component: str, start: float):
+        self.component = component
+        self.start = start
+        self.trace_id = None
+        self.sampled = False
+        self.op = None
+        self.args = []
+        self.stages = [("accept", 0.0)]
+
+    def bind(self, data: dict):
+        self.trace_id = data.get("trace_id")
+        self.sampled = bool(data.get("sampled"))
+        self.op = data.get("function")
+        self.args = data.get("args", [])
+
+    def context(self) -> dict:
+        """Tracing fields to attach to onward RPCs."""
+        if self.trace_id is None:
+            return {}
+        return {"trace_id": self.trace_id, "sampled": self.sampled}
+
+    def stage(self, name: str):
+        self.stages.append((name, round((time.time() - self.start) * 1000, 3)))
+
+    def finish(self, log: SpanLog, **extra):
+        if not (self.sampled and self.trace_id):
+            return
+        record = {"trace_id": self.trace_id, "component": self.component, "op": self.op,
+                  "args": self.args, "start": self.start,
+                  "duration_ms": round((time.time() - self.start) * 1000, 3), "stages": self.stages}
+        record.update(extra)
+        log.write(record)
@@ -4,10 +4,13 @@ Usage: python server.py <node_id>
 node_id: 0..4 (we create 5 edge servers on consecutive ports)
 Hardcoded config:
   edge_base_port = 8001 -> ports 8001..8005
+  edge_control_base_port = 8101 -> control ports 8101..8105 (election/coordinator/heartbeat/notify_cached)
   canonical server at 127.0.0.1:9000
 RPC format:
 - Client sends: <8-byte length><JSON request bytes>
   JSON: {"function": "...", "args": [...], "clock": <int>}
+  optional tracing fields: "trace_id": <str>, "sampled": <bool> (set by the client/LB,
+  forwarded on every onward RPC; sampled requests append a span to <TRACE_DIR>/edge<id>.jsonl)
 - Server responds: <8-byte clock><...> then function-specific payload
 Supported RPC functions (from clients or inter-edge):
 - get_image [id]
@@ -21,11 +24,34 @@ Supported RPC functions (from clients or inter-edge):
 """
 import socket, json, struct, os, sys, threading, time
 
+# components run as scripts from their own folders; shared helpers live in <repo>/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.serving import WorkerPool, send_overloaded, recv_upto, recv_ack, OverloadedError, OVERLOADED
+from common.tracing import Span, SpanLog, TRACE_DIR
+
 HOST = '127.0.0.1'
 EDGE_BASE_PORT = 8001
+EDGE_CONTROL_BASE_PORT = 8101
 NUM_EDGES = 5
 CANONICAL_HOST = '127.0.0.1'
 CANONICAL_PORT = 9000
+# Admission control: cache hits run on the main pool, anything that
+# has to go to the canonical server or another edge (misses, replication) runs on the
+# smaller miss pool so it can never starve hits. A full queue is rejected immediately.
+WORKER_THREADS = 16
+WORKER_QUEUE_LIMIT = 64
+MISS_WORKER_THREADS = 4
+MISS_QUEUE_LIMIT = 16
+CLIENT_IO_TIMEOUT = 2.0  # a client stalling a read/write this long is dropped so it can't pin a worker
+# Control RPCs (election/coordinator/heartbeat/notify_cached) must not queue behind or be
+# shed with data traffic: peers and the LB send them to the edge's control port, whose
+# connections always run on this lane, which handles control RPCs and sheds everything else.
+CONTROL_FUNCTIONS = ("election", "coordinator", "heartbeat", "notify_cached")
+CONTROL_WORKER_THREADS = 2
+CONTROL_QUEUE_LIMIT = 32
+CONTROL_RETRIES = 3
+CONTROL_RETRY_DELAY = 0.5
+TRACED_FUNCTIONS = ("get_image", "get_image_size", "replicate", "notify_cached")
 
 def recv_exact(sock, n: int) -> bytes:
     data = b""
@@ -36,13 +62,24 @@ def recv_exact(sock, n: int) -> bytes:
         data += packet
     return data
 
-def peer_rpc_call(peer_host: str, peer_port: int, function: str, args: list, timeout=5):
+def raise_if_error(payload: bytes):
+    """Turn an {"error": ...} reply body into an exception instead of treating it as data."""
+    if payload == OVERLOADED:
+        raise OverloadedError("overloaded")
+    if payload.startswith(b'{"error"'):
+        try:
+            err = json.loads(payload.decode())
+        except ValueError:
+            return  # just image bytes that happen to look like JSON
+        raise Exception(err.get("error"))
+
+def peer_rpc_call(peer_host: str, peer_port: int, function: str, args: list, timeout=5, trace=None):
     """Sends RPC to peer and returns raw response (clock, maybe size, maybe data)"""
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.settimeout(timeout)
             s.connect((peer_host, peer_port))
-            request = json.dumps({"function": function, "args": args, "clock": 0}).encode()
+            request = json.dumps({"function": function, "args": args, "clock": 0, **(trace or {})}).encode()
             s.sendall(struct.pack("Q", len(request)))
             s.sendall(request)
             # Read response clock
@@ -52,10 +89,16 @@ def peer_rpc_call(peer_host: str, peer_port: int, function: str, args: list, tim
                 size_data = recv_exact(s, 8)
                 (size,) = struct.unpack("Q", size_data)
                 image = recv_exact(s, size)
+                raise_if_error(image)
                 return resp_clock, size, image
             elif function in ("get_image_size",):
                 size_data = recv_exact(s, 8)
                 (size,) = struct.unpack("Q", size_data)
+                # a successful reply ends after the size; anything following it is an error body
+                body = recv_upto(s, size)
+                if body:
+                    raise_if_error(body)
+                    raise Exception(f"Unexpected payload after get_image_size from {peer_port}")
                 return resp_clock, size, None
             else:
                 # generic: may be coordinator/election replies with no payload
@@ -73,10 +116,31 @@ def peer_rpc_call(peer_host: str, peer_port: int, function: str, args: list, tim
         # print(f"peer_rpc_call failed to {peer_host}:{peer_port} -> {e}")
         raise
 
+def control_rpc(peer_id: int, function: str, args: list, timeout, trace=None, retries=CONTROL_RETRIES):
+    """Clock-only RPC to a peer edge's control port, retried while the peer sheds it as overloaded.
+    Raises OverloadedError if every attempt was shed."""
+    peer_port = EDGE_CONTROL_BASE_PORT + peer_id
+    for attempt in range(retries):
+        if attempt:
+            time.sleep(CONTROL_RETRY_DELAY)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect((HOST, peer_port))
+            msg = json.dumps({"function": function, "args": args, "clock": 0, **(trace or {})}).encode()
+            s.sendall(struct.pack("Q", len(msg)))
+            s.sendall(msg)
+            try:
+                recv_ack(s)
+                return
+            except OverloadedError:
+                print(f"control_rpc: {function} shed by {peer_port} (attempt {attempt + 1}/{retries})")
+    raise OverloadedError(f"{function} shed by {peer_port}")
+
 class EdgeServer:
     def __init__(self, node_id:int):
         self.node_id = node_id
         self.port = EDGE_BASE_PORT + node_id
+        self.control_port = EDGE_CONTROL_BASE_PORT + node_id
         self.es_dir = os.path.join(os.getcwd(), f"es{node_id}")
         os.makedirs(self.es_dir, exist_ok=True)
         self.peers = [(EDGE_BASE_PORT + i) for i in range(NUM_EDGES) if i != node_id]
@@ -87,10 +151,16 @@ class EdgeServer:
         self.last_heartbeat = time.time()
         self.heartbeat_interval = 2.0
         self.heartbeat_fail_threshold = 6.0  # if no heartbeat/ping for this many seconds -> election
-        print(f"Edge {node_id} running on port {self.port}, data dir: {self.es_dir}")
+        self.pool = WorkerPool(f"Edge {node_id}", WORKER_THREADS, WORKER_QUEUE_LIMIT)
+        self.miss_pool = WorkerPool(f"Edge {node_id} (miss)", MISS_WORKER_THREADS, MISS_QUEUE_LIMIT)
+        self.control_pool = WorkerPool(f"Edge {node_id} (control)", CONTROL_WORKER_THREADS, CONTROL_QUEUE_LIMIT)
+        self.span_log = SpanLog(os.path.join(TRACE_DIR, f"edge{node_id}.jsonl"))
+        print(f"Edge {node_id} running on port {self.port} (control {self.control_port}), data dir: {self.es_dir}")
 
     def start(self):
-        threading.Thread(target=self._start_listener, daemon=True).start()
+        threading.Thread(target=self._start_listener, args=(self.port, self.pool, False), daemon=True).start()
+        threading.Thread(target=self._start_listener, args=(self.control_port, self.control_pool, True),
+                         daemon=True).start()
         time.sleep(0.5)
         # Start election at startup
         threading.Thread(target=self.run_election, daemon=True).start()
@@ -103,78 +173,200 @@ class EdgeServer:
         except KeyboardInterrupt:
             self.alive = False
 
-    def _start_listener(self):
+    def _start_listener(self, port: int, pool: WorkerPool, control_only: bool):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind((HOST, self.port))
+            s.bind((HOST, port))
             s.listen()
             while self.alive:
                 try:
                     conn, _ = s.accept()
-                    threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+                    if not pool.submit(self.handle_client, conn, time.time(), control_only):
+                        print(f"{pool.name}: worker queue full, rejecting connection")
+                        send_overloaded(conn, drain=True)
                 except Exception:
                     pass
 
-    def handle_client(self, conn: socket.socket):
+    def image_path(self, img_id) -> str:
+        return os.path.join(self.es_dir, f"image{img_id}.jpg")
+
+    def store_image(self, img_id, image: bytes):
+        """Write to a temp file and rename it into place, so a concurrent hit (or the LB's
+        micro-cache) never sees a partially written image."""
+        path = self.image_path(img_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(image)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def is_miss(self, func: str, args: list) -> bool:
+        """Requests that have to leave this edge (canonical fetch or pull from leader)."""
+        if func == "replicate":
+            return True
+        if func in ("get_image", "get_image_size"):
+            return not os.path.exists(self.image_path(args[0]))
+        return False
+
+    def handle_client(self, conn: socket.socket, accepted_at: float, control_only: bool = False):
+        handed_off = False
+        span = Span(f"edge{self.node_id}", accepted_at)
+        span.stage("dequeue")
+        try:
+            conn.settimeout(CLIENT_IO_TIMEOUT)
+            size_data = recv_exact(conn, 8)
+            (size,) = struct.unpack("Q", size_data)
+            request = recv_exact(conn, size).decode()
+            data = json.loads(request)
+            func = data.get("function")
+            args = data.get("args", [])
+            if func in TRACED_FUNCTIONS:
+                span.bind(data)
+            span.stage("request_read")
+            # Simple logging
+            print(f"Edge {self.node_id}({self.port}): Received RPC {func} {args}")
+            if control_only and func not in CONTROL_FUNCTIONS:
+                print(f"Edge {self.node_id}: {func} is not a control RPC, rejecting on control port")
+                send_overloaded(conn, drain=False)
+                span.finish(self.span_log, error="overloaded")
+                return
+            miss = self.is_miss(func, args)
+            span.stage("cache_lookup")
+            if miss:
+                # hand the connection to the miss pool; shed it if that queue is full
+                if self.miss_pool.submit(self.handle_miss, conn, func, args, span):
+                    handed_off = True
+                else:
+                    print(f"Edge {self.node_id}: miss queue full, rejecting {func} {args}")
+                    send_overloaded(conn, drain=False)
+                    span.finish(self.span_log, error="overloaded")
+                return
+            # respond with clock 0 always for simplicity
+            conn.sendall(struct.pack("Q", 0))
+            if func == "get_image":
+                img_id = args[0]
+                # size from the opened file, so it matches the bytes sent even if a replace lands meanwhile
+                with open(self.image_path(img_id), "rb") as f:
+                    filesize = os.fstat(f.fileno()).st_size
+                    conn.sendall(struct.pack("Q", filesize))
+                    conn.sendfile(f)
+                span.stage("send")
+                print(f"Edge {self.node_id}: served image{img_id}.jpg from local cache") 
+            elif func == "get_image_size":
+                img_id = args[0]
+                filesize = os.path.getsize(self.image_path(img_id))
+                conn.sendall(struct.pack("Q", filesize))
+                span.stage("send")
+            elif func == "notify_cached":
+                img_id = args[0]
+                print(f"Edge {self.node_id}: received notify_cached for image{img_id}") 
+                # Only leader reacts to this by initiating replication to other peers
+                if self.is_leader():
+                    self.schedule_replication(img_id, span.context())
+                conn.sendall(struct.pack("Q", 0))
+                span.stage("send")
+            elif func == "election":
+                cand = args[0]
+                # If we receive election from lower id, reply election_ok and start our own election if higher
+                # Reply: send some small payload
+                ok = json.dumps({"ok": True}).encode()
+                conn.sendall(struct.pack("Q", 0))
+                conn.sendall(struct.pack("Q", len(ok)))
+                conn.sendall(ok)
+                # start our election if our id is higher than candidate
+                if self.node_id > cand:
+                    threading.Thread(target=self.run_election, daemon=True).start()
+            elif func == "coordinator":
+                leader = args[0]
+                with self.leader_lock:
+                    self.leader_id = leader
+                print(f"Edge {self.node_id}: new coordinator is {leader}")
+                conn.sendall(struct.pack("Q", 0))
+            elif func == "heartbeat":
+                # simple ping reply
+                with self.leader_lock:
+                    self.last_heartbeat = time.time()
+                conn.sendall(struct.pack("Q", 0))
+            else:
+                # unknown function
+                err = json.dumps({"error": f"Unknown function {func}"}).encode()
+                conn.sendall(struct.pack("Q", len(err)))
+                conn.sendall(err)
+        except socket.timeout:
+            # the client stopped sending/reading: drop it instead of replying
+            print(f"Edge {self.node_id}: client timed out after {CLIENT_IO_TIMEOUT}s, dropping connection")
+            span.finish(self.span_log, error="client timeout")
+            return
+        except Exception as e:
+            # best-effort error send
+            try:
+                err = json.dumps({"error": str(e)}).encode()
+                conn.sendall(struct.pack("Q", 0))
+                conn.sendall(struct.pack("Q", len(err)))
+                conn.sendall(err)
+            except Exception:
+                pass
+            span.finish(self.span_log, error=str(e))
+            return
+        finally:
+            if not handed_off:
+                conn.close()
+        span.finish(self.span_log)
+
+    def handle_miss(self, conn: socket.socket, func: str, args: list, span: Span):
+        """Runs on the miss pool: cache misses and leader-initiated replication."""
+        span.stage("miss_dequeue")
+        error = None
         with conn:
             try:
-                size_data = recv_exact(conn, 8)
-                (size,) = struct.unpack("Q", size_data)
-                request = recv_exact(conn, size).decode()
-                data = json.loads(request)
-                func = data.get("function")
-                args = data.get("args", [])
-                # Simple logging
-                print(f"Edge {self.node_id}({self.port}): Received RPC {func} {args}")
-                # respond with clock 0 always for simplicity
                 conn.sendall(struct.pack("Q", 0))
                 if func == "get_image":
+                    # Cache miss: fetch from canonical
                     img_id = args[0]
-                    local_path = os.path.join(self.es_dir, f"image{img_id}.jpg")
-                    if os.path.exists(local_path):
-                        filesize = os.path.getsize(local_path)
-                        conn.sendall(struct.pack("Q", filesize))
-                        with open(local_path, "rb") as f:
-                            conn.sendfile(f)
-                        print(f"Edge {self.node_id}: served image{img_id}.jpg from local cache") 
-                    else:
-                        # Cache miss: fetch from canonical
-                        print(f"Edge {self.node_id}: cache miss for image{img_id}, fetching from canonical...")
-                        try:
-                            _, size, image = peer_rpc_call(CANONICAL_HOST, CANONICAL_PORT, "get_image", [img_id])
-                            assert(image != None)
-                            # store locally
-                            with open(local_path, "wb") as f:
-                                f.write(image)
-                            conn.sendall(struct.pack("Q", size))
-                            conn.sendall(image)
-                            print(f"Edge {self.node_id}: cached image{img_id}.jpg locally ({size} bytes)" )
-                            # Post-cache actions:
-                            if self.is_leader():
-                                # leader will ensure replication by instructing peers to fetch from leader
-                                threading.Thread(target=self.replicate_to_peers, args=(img_id,), daemon=True).start()
-                            else:
-                                # notify leader to replicate
-                                self.notify_leader_cached(img_id)
-                        except Exception as e:
-                            err = json.dumps({"error": str(e)}).encode()
-                            conn.sendall(struct.pack("Q", len(err)))
-                            conn.sendall(err)
+                    print(f"Edge {self.node_id}: cache miss for image{img_id}, fetching from canonical...")
+                    try:
+                        _, size, image = peer_rpc_call(CANONICAL_HOST, CANONICAL_PORT, "get_image", [img_id],
+                                                       trace=span.context())
+                        span.stage("origin_rpc")
+                        assert(image != None)
+                        # store locally
+                        self.store_image(img_id, image)
+                        span.stage("disk_write")
+                        conn.sendall(struct.pack("Q", size))
+                        conn.sendall(image)
+                        span.stage("send")
+                        print(f"Edge {self.node_id}: cached image{img_id}.jpg locally ({size} bytes)" )
+                        # Post-cache actions:
+                        if self.is_leader():
+                            # leader will ensure replication by instructing peers to fetch from leader
+                            self.schedule_replication(img_id, span.context())
+                        else:
+                            # notify leader to replicate
+                            self.notify_leader_cached(img_id, span.context())
+                            span.stage("notify_leader")
+                    except Exception as e:
+                        error = str(e)
+                        err = json.dumps({"error": str(e)}).encode()
+                        conn.sendall(struct.pack("Q", len(err)))
+                        conn.sendall(err)
                 elif func == "get_image_size":
+                    # Ask canonical for size and return
                     img_id = args[0]
-                    local_path = os.path.join(self.es_dir, f"image{img_id}.jpg")
-                    if os.path.exists(local_path):
-                        filesize = os.path.getsize(local_path)
-                        conn.sendall(struct.pack("Q", filesize))
-                    else:
-                        # Ask canonical for size and return
-                        try:
-                            _, size, _ = peer_rpc_call(CANONICAL_HOST, CANONICAL_PORT, "get_image_size", [img_id])
-                            conn.sendall(struct.pack("Q", size))
-                        except Exception as e:
-                            err = json.dumps({"error": str(e)}).encode()
-                            conn.sendall(struct.pack("Q", len(err)))
-                            conn.sendall(err)
+                    try:
+                        _, size, _ = peer_rpc_call(CANONICAL_HOST, CANONICAL_PORT, "get_image_size", [img_id],
+                                                   trace=span.context())
+                        span.stage("origin_rpc")
+                        conn.sendall(struct.pack("Q", size))
+                        span.stage("send")
+                    except Exception as e:
+                        error = str(e)
+                        err = json.dumps({"error": str(e)}).encode()
+                        conn.sendall(struct.pack("Q", len(err)))
+                        conn.sendall(err)
                 elif func == "replicate":
                     # Instruction from leader: fetch image from leader_host:leader_port
                     img_id = args[0]
@@ -182,63 +374,35 @@ class EdgeServer:
                     leader_port = args[2]
                     print(f"Edge {self.node_id}: replicate request -> pull image{img_id} from leader {leader_port}")
                     try:
-                        _, size, image = peer_rpc_call(leader_host, leader_port, "get_image", [img_id])
+                        _, size, image = peer_rpc_call(leader_host, leader_port, "get_image", [img_id],
+                                                       trace=span.context())
+                        span.stage("leader_rpc")
                         assert(image != None)
-                        local_path = os.path.join(self.es_dir, f"image{img_id}.jpg")
-                        with open(local_path, "wb") as f:
-                            f.write(image)
+                        self.store_image(img_id, image)
+                        span.stage("disk_write")
                         # send acknowledgement payload (optional)
                         ack = json.dumps({"ok": True}).encode()
                         conn.sendall(struct.pack("Q", len(ack)))
                         conn.sendall(ack)
+                        span.stage("send")
                         print(f"Edge {self.node_id}: replicated image{img_id} from leader {leader_port}")
                     except Exception as e:
+                        error = str(e)
                         err = json.dumps({"error": str(e)}).encode()
                         conn.sendall(struct.pack("Q", len(err)))
                         conn.sendall(err)
-                elif func == "notify_cached":
-                    img_id = args[0]
-                    print(f"Edge {self.node_id}: received notify_cached for image{img_id}") 
-                    # Only leader reacts to this by initiating replication to other peers
-                    if self.is_leader():
-                        threading.Thread(target=self.replicate_to_peers, args=(img_id,), daemon=True).start()
-                    conn.sendall(struct.pack("Q", 0))
-                elif func == "election":
-                    cand = args[0]
-                    # If we receive election from lower id, reply election_ok and start our own election if higher
-                    # Reply: send some small payload
-                    ok = json.dumps({"ok": True}).encode()
-                    conn.sendall(struct.pack("Q", 0))
-                    conn.sendall(struct.pack("Q", len(ok)))
-                    conn.sendall(ok)
-                    # start our election if our id is higher than candidate
-                    if self.node_id > cand:
-                        threading.Thread(target=self.run_election, daemon=True).start()
-                elif func == "coordinator":
-                    leader = args[0]
-                    with self.leader_lock:
-                        self.leader_id = leader
-                    print(f"Edge {self.node_id}: new coordinator is {leader}")
-                    conn.sendall(struct.pack("Q", 0))
-                elif func == "heartbeat":
-                    # simple ping reply
-                    with self.leader_lock:
-                        self.last_heartbeat = time.time()
-                    conn.sendall(struct.pack("Q", 0))
-                else:
-                    # unknown function
-                    err = json.dumps({"error": f"Unknown function {func}"}).encode()
-                    conn.sendall(struct.pack("Q", len(err)))
-                    conn.sendall(err)
             except Exception as e:
-                # best-effort error send
-                try:
-                    err = json.dumps({"error": str(e)}).encode()
-                    conn.sendall(struct.pack("Q", 0))
-                    conn.sendall(struct.pack("Q", len(err)))
-                    conn.sendall(err)
-                except Exception:
-                    pass
+                error = str(e)
+                print(f"Edge {self.node_id}: error handling {func} {args} -> {e}")
+        if error is None:
+            span.finish(self.span_log)
+        else:
+            span.finish(self.span_log, error=error)
+
+    def schedule_replication(self, img_id: int, trace=None):
+        # replication is background work: drop it rather than queue behind a saturated miss pool
+        if not self.miss_pool.submit(self.replicate_to_peers, img_id, trace):
+            print(f"Edge {self.node_id}: miss queue full, skipping replication of image{img_id}")
 
     def is_leader(self):
         with self.leader_lock:
@@ -250,7 +414,7 @@ class EdgeServer:
         higher = [i for i in range(NUM_EDGES) if i > self.node_id]
         got_ok = False
         for hid in higher:
-            port = EDGE_BASE_PORT + hid
+            port = EDGE_CONTROL_BASE_PORT + hid
             try:
                 # send election message
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -265,6 +429,9 @@ class EdgeServer:
                     if size_data:
                         (size,) = struct.unpack("Q", size_data)
                         payload = recv_exact(s, size) if size>0 else b""
+                        if payload == OVERLOADED:
+                            # shed, but alive: still defer to it and wait for a coordinator below
+                            print(f"Edge {self.node_id}: election shed by busy node {hid}")
                     got_ok = True
                     print(f"Edge {self.node_id}: got election_ok from {hid}")
             except Exception:
@@ -275,16 +442,10 @@ class EdgeServer:
             print(f"Edge {self.node_id}: no higher node replied, declaring self coordinator" )
             for i in range(NUM_EDGES):
                 if i == self.node_id: continue
-                port = EDGE_BASE_PORT + i
                 try:
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                        s.settimeout(2)
-                        s.connect((HOST, port))
-                        msg = json.dumps({"function": "coordinator", "args": [self.node_id], "clock": 0}).encode()
-                        s.sendall(struct.pack("Q", len(msg)))
-                        s.sendall(msg)
-                        # read optional reply
-                        recv_exact(s, 8)
+                    control_rpc(i, "coordinator", [self.node_id], 2)
+                except OverloadedError as e:
+                    print(f"Edge {self.node_id}: coordinator announcement not delivered -> {e}")
                 except Exception:
                     pass
             with self.leader_lock:
@@ -302,9 +463,11 @@ class EdgeServer:
             # if still no coordinator, restart election
             threading.Thread(target=self.run_election, daemon=True).start()
 
-    def replicate_to_peers(self, img_id:int):
+    def replicate_to_peers(self, img_id:int, trace=None):
         """Leader instructs other peers to pull the image from the leader (leader-initiated replication)."""
         print(f"Edge {self.node_id}: replicating image{img_id} to peers..." )
+        span = Span(f"edge{self.node_id}", time.time())
+        span.bind({"function": "replicate_to_peers", "args": [img_id], **(trace or {})})
         # leader info
         leader_host = HOST
         leader_port = self.port
@@ -313,7 +476,8 @@ class EdgeServer:
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                     s.settimeout(4)
                     s.connect((HOST, p))
-                    msg = json.dumps({"function": "replicate", "args": [img_id, leader_host, leader_port], "clock": 0}).encode()
+                    msg = json.dumps({"function": "replicate", "args": [img_id, leader_host, leader_port], "clock": 0,
+                                      **span.context()}).encode()
                     s.sendall(struct.pack("Q", len(msg)))
                     s.sendall(msg)
                     # read ack
@@ -322,27 +486,28 @@ class EdgeServer:
                     if size_data:
                         (size,) = struct.unpack("Q", size_data)
                         payload = recv_exact(s, size) if size>0 else b""
+                        if payload == OVERLOADED:
+                            raise OverloadedError("overloaded")
+                span.stage(f"replicated:{p}")
                 print(f"Edge {self.node_id}: instruct replication to {p} completed") 
             except Exception as e:
+                span.stage(f"failed:{p}")
                 print(f"Edge {self.node_id}: replication to {p} failed -> {e}") 
+        span.finish(self.span_log)
 
-    def notify_leader_cached(self, img_id:int):
+    def notify_leader_cached(self, img_id:int, trace=None):
         with self.leader_lock:
             leader = self.leader_id
         if leader is None:
             print(f"Edge {self.node_id}: no leader known, starting election to ensure replication" )
             threading.Thread(target=self.run_election, daemon=True).start()
             return
-        leader_port = EDGE_BASE_PORT + leader
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(3)
-                s.connect((HOST, leader_port))
-                msg = json.dumps({"function": "notify_cached", "args": [img_id], "clock": 0}).encode()
-                s.sendall(struct.pack("Q", len(msg)))
-                s.sendall(msg)
-                recv_exact(s, 8)  # read ack clock
+            control_rpc(leader, "notify_cached", [img_id], 3, trace)
             print(f"Edge {self.node_id}: notified leader {leader} about cached image{img_id}") 
+        except OverloadedError as e:
+            # leader is alive, just busy: no election, but this image won't be replicated
+            print(f"Edge {self.node_id}: leader too busy, image{img_id} not replicated -> {e}")
         except Exception as e:
             print(f"Edge {self.node_id}: failed to notify leader -> {e}") 
             # if notify fails, maybe leader is down -> trigger election
@@ -359,17 +524,13 @@ class EdgeServer:
                 if leader == self.node_id:
                     self.last_heartbeat = time.time()
                 continue
-            leader_port = EDGE_BASE_PORT + leader
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(2)
-                    s.connect((HOST, leader_port))
-                    msg = json.dumps({"function": "heartbeat", "args": [], "clock": 0}).encode()
-                    s.sendall(struct.pack("Q", len(msg)))
-                    s.sendall(msg)
-                    recv_exact(s, 8)  # read reply clock
-                    # got heartbeat ack -> update timestamp
-                    self.last_heartbeat = time.time()
+                # a shed heartbeat still proves the leader is up, so no retries needed
+                control_rpc(leader, "heartbeat", [], 2, retries=1)
+                # got heartbeat ack -> update timestamp
+                self.last_heartbeat = time.time()
+            except OverloadedError:
+                self.last_heartbeat = time.time()
             except Exception:
                 # check elapsed since last heartbeat
                 if time.time() - self.last_heartbeat > self.heartbeat_fail_threshold:
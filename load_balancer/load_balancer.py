@@ -4,20 +4,67 @@ Usage: python load_balancer.py
 Hardcoded config:
   lb_port = 8000
   edge_base_port = 8001
+  edge_control_base_port = 8101 (heartbeats go to the edges' control ports)
   num_edges = 5
   host = '127.0.0.1'
 The LB performs round-robin over healthy edge servers.
 Health checks are done via 'heartbeat' RPC every 5 seconds.
+Connections are served by a bounded worker pool; when its queue is full the LB
+replies {"error": "overloaded"} immediately. An edge answering "overloaded" is
+skipped and the request is retried on the next healthy edge. A client that stalls
+reading or writing for CLIENT_IO_TIMEOUT is dropped so it can't pin a worker.
+Optional micro-cache (MICRO_CACHE_ENABLED): successful get_image/get_image_size
+responses the LB forwards are kept in a small byte-bounded cache and served
+without contacting an edge. Admission is TinyLFU-style: a new response only
+evicts the LRU victim if it has been requested more often recently, so
+one-hit wonders don't displace hot images. Entries expire after
+MICRO_CACHE_TTL seconds or on an 'invalidate' [id] RPC sent to the LB.
+Tracing: every forwarded request carries a "trace_id" (the client's, or one the LB
+generates) and a "sampled" flag decided here with probability TRACE_SAMPLE_RATE.
+Each hop appends sampled spans with per-stage timings to <TRACE_DIR>/<component>.jsonl
+(<repo>/traces unless $CDN_TRACE_DIR is set);
+see trace_analyzer/trace_analyzer.py.
+Edge waits are bounded by EDGE_TIMEOUT. With HEDGING_ENABLED, if the chosen edge
+has not sent its <clock><size> header within the HEDGE_PERCENTILE of recent header
+latency, the request is also sent to a second healthy edge; the first to answer is
+streamed to the client and the other connection is closed. Hedges are budgeted to
+roughly HEDGE_BUDGET_RATIO of forwarded requests.
 Clients should connect to the LB at port 8000 instead of directly to edges.
 """
-import socket, json, struct, threading, time
+import socket, json, struct, threading, time, os, sys, random, uuid, select
+from collections import OrderedDict, deque
+
+# components run as scripts from their own folders; shared helpers live in <repo>/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.serving import WorkerPool, send_overloaded, OVERLOADED
+from common.tracing import Span, SpanLog, TRACE_DIR
 
 HOST = '127.0.0.1'
 LB_PORT = 8000
 EDGE_BASE_PORT = 8001
+EDGE_CONTROL_BASE_PORT = 8101
 NUM_EDGES = 5
 HEALTH_CHECK_INTERVAL = 5.0
 HEARTBEAT_TIMEOUT = 1.0
+WORKER_THREADS = 32
+WORKER_QUEUE_LIMIT = 128
+CLIENT_IO_TIMEOUT = 2.0  # a client stalling a read/write this long is dropped so it can't pin a worker
+MICRO_CACHE_ENABLED = False
+MICRO_CACHE_MAX_BYTES = 4 * 1024 * 1024
+MICRO_CACHE_MAX_ITEM_BYTES = 256 * 1024  # bigger responses are streamed through uncached
+MICRO_CACHE_TTL = 30.0
+MICRO_CACHE_SKETCH_WIDTH = 4096
+CACHEABLE_FUNCTIONS = ("get_image", "get_image_size")
+TRACE_SAMPLE_RATE = 0.1
+EDGE_TIMEOUT = 10.0  # max wait for an edge to start (and keep) answering
+HEDGING_ENABLED = False
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20  # below this many latency samples use HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = 0.05
+HEDGE_MIN_DELAY = 0.005
+HEDGE_BUDGET_RATIO = 0.05  # each forwarded request earns this many hedge tokens
+HEDGE_BUDGET_BURST = 10.0
+LATENCY_WINDOW = 1000
 
 def recv_exact(sock, n: int) -> bytes:
     data = b""
@@ -28,12 +75,157 @@ def recv_exact(sock, n: int) -> bytes:
         data += packet
     return data
 
+class FrequencySketch:
+    """Count-min sketch of recent request frequency (the 'TinyLFU' part of the micro-cache).
+    Counters are halved every `sample_size` increments so popularity ages out."""
+    DEPTH = 4
+
+    def __init__(self, width: int):
+        self.width = width
+        self.rows = [[0] * width for _ in range(self.DEPTH)]
+        self.sample_size = 10 * width
+        self.additions = 0
+
+    def _slots(self, key):
+        return [hash((seed, key)) % self.width for seed in range(self.DEPTH)]
+
+    def increment(self, key):
+        for row, slot in zip(self.rows, self._slots(key)):
+            row[slot] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for row in self.rows:
+                for i in range(self.width):
+                    row[i] >>= 1
+            self.additions //= 2
+
+    def estimate(self, key) -> int:
+        return min(row[slot] for row, slot in zip(self.rows, self._slots(key)))
+
+class MicroCache:
+    """Byte-bounded LRU of raw edge responses keyed by (function, image id), with TinyLFU admission."""
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (response bytes, expires_at)
+        self.used_bytes = 0
+        self.sketch = FrequencySketch(MICRO_CACHE_SKETCH_WIDTH)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Record an access to `key` and return the cached response, or None."""
+        with self.lock:
+            self.sketch.increment(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if time.time() >= expires_at:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return response
+
+    def put(self, key, response: bytes) -> bool:
+        """Offer a response for caching; returns whether it was admitted."""
+        if len(response) > self.max_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            # Expired entries free their space unconditionally, before popularity is compared
+            now = time.time()
+            for expired in [k for k, (_, expires_at) in self.entries.items() if now >= expires_at]:
+                self._remove(expired)
+            # Evict LRU victims only while the candidate is more popular than each of them
+            freq = self.sketch.estimate(key)
+            victims = []
+            freed = 0
+            for victim in self.entries:
+                if self.used_bytes - freed + len(response) <= self.max_bytes:
+                    break
+                if self.sketch.estimate(victim) >= freq:
+                    return False
+                victims.append(victim)
+                freed += len(self.entries[victim][0])
+            for victim in victims:
+                self._remove(victim)
+            self.entries[key] = (response, now + self.ttl)
+            self.used_bytes += len(response)
+            return True
+
+    def invalidate(self, img_id):
+        img_id = normalize_image_id(img_id)
+        with self.lock:
+            for func in CACHEABLE_FUNCTIONS:
+                if (func, img_id) in self.entries:
+                    self._remove((func, img_id))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def _remove(self, key):
+        response, _ = self.entries.pop(key)
+        self.used_bytes -= len(response)
+
+def normalize_image_id(img_id):
+    """Image ids arrive as JSON ints or strings; edges map both 5 and "5" to image5.jpg.
+    Returns the int id, or None for ids that don't name the same file as their int form ("05", 5.0)."""
+    try:
+        value = int(img_id)
+    except (TypeError, ValueError):
+        return None
+    return value if str(value) == str(img_id) else None
+
+def is_cacheable_response(func: str, response: bytes) -> bool:
+    """Only successful replies are cached: <clock><size> for sizes, <clock><size><image> for images.
+    Edges always follow the size with an {"error": ...} body when a lookup fails, so a
+    16-byte get_image_size reply is a real size."""
+    if len(response) < 16:
+        return False
+    if func == "get_image_size":
+        return len(response) == 16
+    (size,) = struct.unpack("Q", response[8:16])
+    return len(response) == 16 + size and not response[16:].startswith(b'{"error"')
+
+def header_length(head: bytes) -> int:
+    """Bytes of an edge reply the LB inspects before committing to it: the <clock><size>
+    header, plus the payload when its size matches the overload marker."""
+    if len(head) >= 16 and struct.unpack("Q", head[8:16])[0] == len(OVERLOADED):
+        return 16 + len(OVERLOADED)
+    return 16
+
+class LatencyTracker:
+    """Sliding window of recent edge time-to-header samples (seconds)."""
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float):
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
 class LoadBalancer:
     def __init__(self):
         self.healthy = [True] * NUM_EDGES
         self.current_index = 0
         self.lock = threading.Lock()
         self.alive = True
+        self.pool = WorkerPool("Load Balancer", WORKER_THREADS, WORKER_QUEUE_LIMIT)
+        self.micro_cache = MicroCache(MICRO_CACHE_MAX_BYTES, MICRO_CACHE_TTL) if MICRO_CACHE_ENABLED else None
+        self.span_log = SpanLog(os.path.join(TRACE_DIR, "lb.jsonl"))
+        self.edge_latency = LatencyTracker(LATENCY_WINDOW)
+        self.hedge_tokens = HEDGE_BUDGET_BURST
+        self.hedge_lock = threading.Lock()
         print(f"Load Balancer initialized on port {LB_PORT}")
 
     def start(self):
@@ -56,13 +248,16 @@ class LoadBalancer:
                 try:
                     conn, addr = s.accept()
                     print(f"Load Balancer: Accepted connection from {addr}")
-                    threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+                    if not self.pool.submit(self.handle_client, conn, time.time()):
+                        print(f"Load Balancer: worker queue full, rejecting {addr}")
+                        send_overloaded(conn, drain=True)
                 except Exception as e:
                     print(f"Load Balancer: Error accepting connection: {e}")
 
-    def choose_edge(self) -> int:
+    def choose_edge(self, exclude=()) -> int:
         with self.lock:
-            healthy_indices = [i for i in range(NUM_EDGES) if self.healthy[i]]
+            healthy_indices = [i for i in range(NUM_EDGES)
+                               if self.healthy[i] and EDGE_BASE_PORT + i not in exclude]
             if not healthy_indices:
                 raise Exception("No healthy edge servers available")
             idx = self.current_index % len(healthy_indices)
@@ -71,32 +266,76 @@ class LoadBalancer:
             print(f"Load Balancer: Chosen edge server at port {port}")
             return port
 
-    def handle_client(self, client_conn: socket.socket):
+    def handle_client(self, client_conn: socket.socket, accepted_at: float):
+        span = Span("lb", accepted_at)
+        span.stage("dequeue")
+        error = None
         try:
-            edge_port = self.choose_edge()
-            print(f"Load Balancer: Forwarding request to edge at {edge_port}")
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as edge_sock:
-                edge_sock.connect((HOST, edge_port))
-                print(f"Load Balancer: Connected to edge at {edge_port}")
-                # Receive full request from client
+            client_conn.settimeout(CLIENT_IO_TIMEOUT)
+            # Receive full request from client
+            try:
                 size_data = recv_exact(client_conn, 8)
                 (req_len,) = struct.unpack("Q", size_data)
                 req_json = recv_exact(client_conn, req_len)
-                request_data = json.loads(req_json.decode())
-                print(f"Load Balancer: Received request: {request_data}")
-                # Forward to edge
-                edge_sock.sendall(size_data)
-                edge_sock.sendall(req_json)
-                edge_sock.shutdown(socket.SHUT_WR)
-                print(f"Load Balancer: Forwarded request to edge {edge_port}")
-                # Forward response from edge to client
-                while True:
-                    data = edge_sock.recv(4096)
-                    if not data:
-                        break
-                    client_conn.sendall(data)
-                print(f"Load Balancer: Forwarded response from edge {edge_port} to client")
+            except socket.timeout:
+                # idle or trickling client: drop it instead of replying
+                error = "client timeout"
+                print(f"Load Balancer: Client sent no request within {CLIENT_IO_TIMEOUT}s, dropping connection")
+                return
+            request_data = json.loads(req_json.decode())
+            print(f"Load Balancer: Received request: {request_data}")
+            func = request_data.get("function")
+            args = request_data.get("args", [])
+            # Root the trace here unless the client already did; edges inherit both fields
+            request_data.setdefault("trace_id", uuid.uuid4().hex)
+            request_data.setdefault("sampled", random.random() < TRACE_SAMPLE_RATE)
+            req_json = json.dumps(request_data).encode()
+            size_data = struct.pack("Q", len(req_json))
+            span.bind(request_data)
+            span.stage("request_read")
+            if func == "invalidate":
+                self.invalidate(args[0])
+                ok = json.dumps({"ok": True}).encode()
+                client_conn.sendall(struct.pack("Q", 0))
+                client_conn.sendall(struct.pack("Q", len(ok)))
+                client_conn.sendall(ok)
+                return
+            cache_key = None
+            if self.micro_cache is not None and func in CACHEABLE_FUNCTIONS and args:
+                img_id = normalize_image_id(args[0])
+                cache_key = (func, img_id) if img_id is not None else None
+            if cache_key is not None:
+                cached = self.micro_cache.get(cache_key)
+                span.stage("cache_lookup")
+                if cached is not None:
+                    client_conn.sendall(cached)
+                    span.stage("send")
+                    print(f"Load Balancer: Served {func} {args} from micro-cache")
+                    return
+            tried = set()
+            while True:
+                try:
+                    edge_port = self.choose_edge(exclude=tried)
+                except Exception:
+                    if not tried:
+                        raise
+                    # every healthy edge shed the request
+                    print("Load Balancer: All edges overloaded, rejecting request")
+                    send_overloaded(client_conn, drain=False)
+                    error = "overloaded"
+                    return
+                tried.add(edge_port)
+                span.stage(f"route:{edge_port}")
+                print(f"Load Balancer: Forwarding request to edge at {edge_port}")
+                capture = bytearray() if cache_key is not None else None
+                if self.forward_to_edge(edge_port, size_data, req_json, client_conn, capture, span, tried):
+                    if capture is not None and is_cacheable_response(func, capture):
+                        if self.micro_cache.put(cache_key, bytes(capture)):
+                            print(f"Load Balancer: Cached {func} {args} in micro-cache")
+                    return
+                print(f"Load Balancer: Edge {edge_port} overloaded, retrying on another edge")
         except Exception as e:
+            error = str(e)
             print(f"Load Balancer: Error handling client: {e}")
             # Send error response to client
             try:
@@ -112,6 +351,137 @@ class LoadBalancer:
         finally:
             client_conn.close()
             print("Load Balancer: Closed client connection")
+            if error is None:
+                span.finish(self.span_log)
+            else:
+                span.finish(self.span_log, error=error)
+
+    def hedge_delay(self) -> float:
+        delay = self.edge_latency.percentile(HEDGE_PERCENTILE)
+        return max(HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY if delay is None else delay)
+
+    def take_hedge_token(self) -> bool:
+        with self.hedge_lock:
+            if self.hedge_tokens >= 1:
+                self.hedge_tokens -= 1
+                return True
+            return False
+
+    def send_to_edge(self, edge_port: int, size_data: bytes, req_json: bytes) -> socket.socket:
+        edge_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            edge_sock.settimeout(EDGE_TIMEOUT)
+            edge_sock.connect((HOST, edge_port))
+            print(f"Load Balancer: Connected to edge at {edge_port}")
+            edge_sock.sendall(size_data)
+            edge_sock.sendall(req_json)
+            edge_sock.shutdown(socket.SHUT_WR)
+        except Exception:
+            edge_sock.close()
+            raise
+        print(f"Load Balancer: Forwarded request to edge {edge_port}")
+        return edge_sock
+
+    def forward_to_edge(self, edge_port: int, size_data: bytes, req_json: bytes, client_conn: socket.socket,
+                        capture: bytearray = None, span: Span = None, tried: set = None) -> bool:
+        """Relay one request to an edge (hedging to a second one if enabled) and stream the response back.
+        Returns False (having sent nothing to the client) if every edge asked shed it as overloaded.
+        Edges used as hedges are added to `tried`.
+        If `capture` is given, a copy of the response is appended to it unless it grows
+        past MICRO_CACHE_MAX_ITEM_BYTES, in which case it is left empty."""
+        with self.hedge_lock:
+            self.hedge_tokens = min(HEDGE_BUDGET_BURST, self.hedge_tokens + HEDGE_BUDGET_RATIO)
+        started = time.time()
+        # edge socket -> [port, sent_at, bytes of <clock><size> (+ overload body) read so far]
+        pending = {self.send_to_edge(edge_port, size_data, req_json): [edge_port, started, b""]}
+        hedge_at = started + self.hedge_delay() if HEDGING_ENABLED else None
+        deadline = started + EDGE_TIMEOUT
+        shed = False
+        try:
+            # An edge sends its clock before it does any work (e.g. an origin fetch), so an
+            # edge only counts as answering once its <clock><size> header is in. Headers are
+            # read without blocking so any pending edge can still win.
+            while pending:
+                wait_until = deadline if hedge_at is None else min(deadline, hedge_at)
+                ready, _, _ = select.select(list(pending), [], [], max(0.0, wait_until - time.time()))
+                if not ready:
+                    if time.time() >= deadline:
+                        raise TimeoutError(f"No response from edge within {EDGE_TIMEOUT}s")
+                    # the first edge is slower than usual: hedge once, if the budget allows
+                    hedge_at = None
+                    if self.take_hedge_token():
+                        try:
+                            busy = set(tried or ()) | {port for port, _, _ in pending.values()}
+                            hedge_port = self.choose_edge(exclude=busy)
+                            pending[self.send_to_edge(hedge_port, size_data, req_json)] = [hedge_port, time.time(), b""]
+                            if tried is not None:
+                                tried.add(hedge_port)
+                            if span is not None:
+                                span.stage(f"hedge:{hedge_port}")
+                            print(f"Load Balancer: Hedged request to edge {hedge_port}")
+                        except Exception as e:
+                            print(f"Load Balancer: Could not hedge request: {e}")
+                    continue
+                for edge_sock in ready:
+                    entry = pending[edge_sock]
+                    edge_port, sent_at, head = entry
+                    try:
+                        data = edge_sock.recv(header_length(head) - len(head))
+                    except OSError:
+                        data = b""
+                    head += data
+                    entry[2] = head
+                    if data and len(head) < header_length(head):
+                        continue  # header (or possible overload body) still incomplete
+                    del pending[edge_sock]
+                    if not head:
+                        edge_sock.close()
+                        print(f"Load Balancer: Edge {edge_port} closed connection without responding")
+                        continue
+                    if head[16:] == OVERLOADED:
+                        edge_sock.close()
+                        shed = True
+                        if span is not None:
+                            span.stage("edge_overloaded")
+                        continue
+                    if span is not None:
+                        span.stage(f"header:{edge_port}")
+                    self.edge_latency.record(time.time() - sent_at)
+                    # this edge won: cancel the others by dropping their connections
+                    for loser in pending:
+                        loser.close()
+                    pending.clear()
+                    with edge_sock:
+                        client_conn.sendall(head)
+                        if capture is not None:
+                            capture += head
+                        # Forward response from edge to client
+                        while True:
+                            data = edge_sock.recv(4096)
+                            if not data:
+                                break
+                            client_conn.sendall(data)
+                            if capture is not None:
+                                capture += data
+                                if len(capture) > MICRO_CACHE_MAX_ITEM_BYTES:
+                                    capture.clear()
+                                    capture = None
+                    if span is not None:
+                        span.stage("send")
+                    print(f"Load Balancer: Forwarded response from edge {edge_port} to client")
+                    return True
+            if shed:
+                return False
+            raise ConnectionError("Edge closed connection without responding")
+        finally:
+            for edge_sock in pending:
+                edge_sock.close()
+
+    def invalidate(self, img_id):
+        """Invalidation hook: drop any micro-cached responses for `img_id`."""
+        if self.micro_cache is not None:
+            self.micro_cache.invalidate(img_id)
+            print(f"Load Balancer: Invalidated image{img_id} in micro-cache")
 
     def health_check(self):
         while self.alive:
@@ -120,7 +490,8 @@ class LoadBalancer:
                 try:
                     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                         s.settimeout(HEARTBEAT_TIMEOUT)
-                        s.connect((HOST, port))
+                        # heartbeat on the control port so it never queues behind data traffic
+                        s.connect((HOST, EDGE_CONTROL_BASE_PORT + i))
                         req = json.dumps({"function": "heartbeat", "args": [], "clock": 0}).encode()
                         s.sendall(struct.pack("Q", len(req)))
                         s.sendall(req)
@@ -1,7 +1,16 @@
-import socket, json, struct, os, threading
+import socket, json, struct, os, sys, time
+
+# components run as scripts from their own folders; shared helpers live in <repo>/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.serving import WorkerPool, send_overloaded
+from common.tracing import Span, SpanLog, TRACE_DIR
 
 HOST = "127.0.0.1"
 PORT = 9000  # canonical server port (hardcoded)
+WORKER_THREADS = 16
+WORKER_QUEUE_LIMIT = 64  # connections beyond this are rejected with {"error": "overloaded"}
+CLIENT_IO_TIMEOUT = 2.0  # a client stalling a read/write this long is dropped so it can't pin a worker
+span_log = SpanLog(os.path.join(TRACE_DIR, "canonical.jsonl"))
 
 def recv_exact(sock, n: int) -> bytes:
     data = b""
@@ -15,15 +24,21 @@ def recv_exact(sock, n: int) -> bytes:
 def get_image_path(id: int):
     return os.path.join(os.path.dirname(__file__), "images", f"image{id}.jpg")
 
-def handle_request(conn: socket.socket):
+def handle_request(conn: socket.socket, accepted_at: float):
+    span = Span("canonical", accepted_at)
+    span.stage("dequeue")
+    error = None
     with conn:
         try:
+            conn.settimeout(CLIENT_IO_TIMEOUT)
             size_data = recv_exact(conn, 8)
             (size,) = struct.unpack("Q", size_data)
             request = recv_exact(conn, size).decode()
             data = json.loads(request)
             func = data.get("function")
             args = data.get("args", [])
+            span.bind(data)
+            span.stage("request_read")
             # Incremental logical clock is not used here; echo back a dummy clock 0
             # Always respond with clock 0
             conn.sendall(struct.pack("Q", 0))
@@ -32,6 +47,7 @@ def handle_request(conn: socket.socket):
                 img_id = args[0]
                 path = get_image_path(img_id)
                 if not os.path.exists(path):
+                    error = "not found"
                     err = json.dumps({"error": f"image{img_id}.jpg not found on canonical server"}).encode()
                     conn.sendall(struct.pack("Q", len(err)))
                     conn.sendall(err)
@@ -42,24 +58,32 @@ def handle_request(conn: socket.socket):
                     # send file bytes
                     with open(path, "rb") as f:
                         conn.sendfile(f)
+                    span.stage("send")
                     print(f"Sent image{img_id}.jpg to port {conn.getsockname()[1]}")
             elif func == "get_image_size":
                 img_id = args[0]
                 path = get_image_path(img_id)
                 print(f"Received get_image_size from port {conn.getsockname()[1]} for image{img_id}.jpg")
                 if not os.path.exists(path):
+                    error = "not found"
                     err = json.dumps({"error": f"image{img_id}.jpg not found on canonical server"}).encode()
                     conn.sendall(struct.pack("Q", len(err)))
                     conn.sendall(err)
                 else:
                     filesize = os.path.getsize(path)
                     conn.sendall(struct.pack("Q", filesize))
+                    span.stage("send")
                     print(f"Sent image{img_id}.jpg's size to port {conn.getsockname()[1]}")
             else:
                 err = json.dumps({"error": f"Unknown function {func}"}).encode()
                 conn.sendall(struct.pack("Q", len(err)))
                 conn.sendall(err)
+        except socket.timeout:
+            # the client stopped sending/reading: drop it instead of replying
+            error = "client timeout"
+            print(f"Canonical server: client timed out after {CLIENT_IO_TIMEOUT}s, dropping connection")
         except Exception as e:
+            error = str(e)
             try:
                 err = json.dumps({"error": str(e)}).encode()
                 conn.sendall(struct.pack("Q", 0))
@@ -67,17 +91,24 @@ def handle_request(conn: socket.socket):
                 conn.sendall(err)
             except Exception:
                 pass
+    if error is None:
+        span.finish(span_log)
+    else:
+        span.finish(span_log, error=error)
 
 def main():
     print(f"Canonical server starting on {HOST}:{PORT}") 
     os.chdir(os.path.dirname(__file__))
+    pool = WorkerPool("Canonical server", WORKER_THREADS, WORKER_QUEUE_LIMIT)
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, PORT))
         s.listen()
         while True:
             conn , _ = s.accept()
-            threading.Thread(target=handle_request, args=(conn,), daemon=True).start()
+            if not pool.submit(handle_request, conn, time.time()):
+                print("Canonical server: worker queue full, rejecting connection")
+                send_overloaded(conn, drain=True)
 
 if __name__ == '__main__':
     main()
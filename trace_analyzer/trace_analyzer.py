@@ -0,0 +1,111 @@
+"""
+Offline analyzer for the sampled span logs written by the LB, edges and canonical server.
+Usage: python trace_analyzer.py [trace_dir] [num_slowest]
+  trace_dir defaults to the components' shared TRACE_DIR: <repo>/traces, or $CDN_TRACE_DIR
+  num_slowest defaults to 10
+Each line of <trace_dir>/*.jsonl is one span: one request as seen by one hop, with
+"stages" = [[name, ms since accept], ...]. Spans sharing a trace_id belong to the
+same client request (LB -> edge -> canonical, plus any replication it triggered).
+Prints:
+- per component/op latency percentiles
+- per-stage breakdown (time between consecutive stages, so queueing, disk,
+  origin RPC and send show up separately)
+- the slowest traces with every hop's stage timeline
+"""
+import json, os, sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tracing import TRACE_DIR
+
+def load_spans(trace_dir: str) -> list:
+    spans = []
+    for name in sorted(os.listdir(trace_dir)):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(trace_dir, name)) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    pass  # torn last line if a component was killed mid-write
+    return spans
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def stage_deltas(span: dict):
+    """(stage, ms spent reaching it from the previous stage). 'route:8003' -> 'route'."""
+    prev = 0.0
+    for name, at in span["stages"]:
+        yield name.split(":")[0], at - prev
+        prev = at
+
+def print_latency_table(spans: list):
+    by_op = defaultdict(list)
+    for span in spans:
+        by_op[(span["component"], span["op"])].append(span["duration_ms"])
+    print(f"{'component':<12}{'op':<22}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for (component, op), durations in sorted(by_op.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+        print(f"{component:<12}{str(op):<22}{len(durations):>7}{percentile(durations, 50):>10.2f}"
+              f"{percentile(durations, 99):>10.2f}{max(durations):>10.2f}")
+
+def print_stage_breakdown(spans: list):
+    by_stage = defaultdict(list)
+    for span in spans:
+        component = span["component"].rstrip("0123456789")  # pool edge0..edge4 together
+        for stage, delta in stage_deltas(span):
+            if stage != "accept":
+                by_stage[(component, stage)].append(delta)
+    print(f"{'component':<12}{'stage':<22}{'count':>7}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for (component, stage), deltas in sorted(by_stage.items()):
+        print(f"{component:<12}{stage:<22}{len(deltas):>7}{sum(deltas) / len(deltas):>10.2f}"
+              f"{percentile(deltas, 50):>10.2f}{percentile(deltas, 99):>10.2f}")
+
+def print_slowest(spans: list, num_slowest: int):
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span)
+
+    def root(trace_spans):
+        # the LB span if the request came through the LB, otherwise the longest hop
+        lb_spans = [s for s in trace_spans if s["component"] == "lb"]
+        return max(lb_spans or trace_spans, key=lambda s: s["duration_ms"])
+
+    ranked = sorted(traces.items(), key=lambda kv: root(kv[1])["duration_ms"], reverse=True)
+    for trace_id, trace_spans in ranked[:num_slowest]:
+        top = root(trace_spans)
+        print(f"trace {trace_id}: {top['op']} {top['args']} {top['duration_ms']:.2f} ms"
+              + (f" error={top['error']}" if "error" in top else ""))
+        for span in sorted(trace_spans, key=lambda s: s["start"]):
+            offset = (span["start"] - top["start"]) * 1000
+            stages = " ".join(f"{name}@{at:.2f}" for name, at in span["stages"])
+            print(f"  +{offset:8.2f} ms {span['component']:<10}{str(span['op']):<20}"
+                  f"{span['duration_ms']:8.2f} ms  {stages}"
+                  + (f"  error={span['error']}" if "error" in span else ""))
+
+def main():
+    trace_dir = sys.argv[1] if len(sys.argv) > 1 else TRACE_DIR
+    num_slowest = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    if not os.path.isdir(trace_dir):
+        print(f"No trace directory at {trace_dir}")
+        sys.exit(1)
+    spans = load_spans(trace_dir)
+    if not spans:
+        print(f"No spans found in {trace_dir}")
+        return
+    print(f"Loaded {len(spans)} spans from {trace_dir}\n")
+    print("== Latency by component/op ==")
+    print_latency_table(spans)
+    print("\n== Stage breakdown (time since previous stage) ==")
+    print_stage_breakdown(spans)
+    print(f"\n== {num_slowest} slowest traces ==")
+    print_slowest(spans, num_slowest)
+
+if __name__ == "__main__":
+    main()